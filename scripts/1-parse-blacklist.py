@@ -26,44 +26,45 @@ INPUT_FILE = "blacklist/README.md"
 OUTPUT_FILE = "data/companies.json"
 PARSE_ERRORS_LOG = "data/parse_errors.log"
 
+# 预编译正则表达式
+# "名单列表"标题后的表格，不包含"已取消996名单列表"部分
+_TABLE_RE = re.compile(r'名单列表\s*\n-{3,}\s*\n((?:\|.*\|\s*\n)+)', re.DOTALL)
+# Markdown链接格式 [名称](URL)
+_LINK_RE = re.compile(r'\[([^\]]+)\]\(([^)]+)\)')
+# 证据链接格式 [文本](URL)，文本可为空
+_EVIDENCE_LINK_RE = re.compile(r'\[([^\]]*)\]\(([^)]+)\)')
+# 表头行和分隔行
+_SKIP_RE = re.compile(r'---|所在城市|公司名字|曝光/施行时间|制度描述|证据内容')
+
+# 证据图片扩展名
+_IMG_EXTS = frozenset({'png', 'jpg', 'jpeg', 'gif', 'bmp'})
+
+# 表格行补齐用的空字段
+_FIVE_BLANKS = [''] * 5
+
 def extract_markdown_table(content: str) -> Optional[str]:
     """从Markdown内容中提取表格部分"""
     # 查找"名单列表"标题后的表格，确保不包含"已取消996名单列表"部分
-    # 使用更精确的模式，匹配"名单列表"后直到遇到下一个标题或空行
-    pattern = r'名单列表\s*\n-{3,}\s*\n((?:\|.*\|\s*\n)+)'
-    match = re.search(pattern, content, re.DOTALL)
+    match = _TABLE_RE.search(content)
     if match:
         return match.group(1).strip()
     return None
 
 def parse_markdown_table(table_content: str) -> List[List[str]]:
     """解析Markdown表格为二维数组"""
-    lines = table_content.strip().split('\n')
     table_data = []
 
-    # 跳过表头行和分隔行
-    skip_patterns = ['---', '所在城市', '公司名字', '曝光/施行时间', '制度描述', '证据内容']
-
-    for line in lines:
+    for line in table_content.splitlines():
         line = line.strip()
-        if '|' in line and line.count('|') >= 5:  # 确保至少有5个分隔符
-            # 检查是否是需要跳过的行
-            should_skip = False
-            for pattern in skip_patterns:
-                if pattern in line:
-                    should_skip = True
-                    break
-
-            if should_skip:
-                continue
-
-            # 分割单元格并清理空白
-            cells = [cell.strip() for cell in line.split('|')[1:-1]]
-            if cells and any(cell for cell in cells):  # 确保不是空行
-                # 确保有5个字段，不足的补空字符串
-                while len(cells) < 5:
-                    cells.append('')
-                table_data.append(cells[:5])  # 只取前5个字段
+        # 确保至少有5个分隔符，并跳过表头行和分隔行
+        if line.count('|') < 5 or _SKIP_RE.search(line):
+            continue
+
+        # 分割单元格并清理空白
+        cells = [cell.strip() for cell in line.split('|')[1:-1]]
+        if any(cells):  # 确保不是空行
+            # 确保有5个字段，不足的补空字符串，多余的截断
+            table_data.append((cells + _FIVE_BLANKS)[:5])
 
     return table_data
 
@@ -75,8 +76,7 @@ def extract_company_info(raw_company_text: str) -> Dict[str, str]:
     }
 
     # 匹配Markdown链接格式 [名称](URL)
-    link_pattern = r'\[([^\]]+)\]\(([^)]+)\)'
-    match = re.search(link_pattern, raw_company_text)
+    match = _LINK_RE.search(raw_company_text)
 
     if match:
         company_info["company_name"] = match.group(1).strip()
@@ -90,16 +90,13 @@ def extract_evidence_links(evidence_content: str) -> Dict[str, List[str]]:
     evidence_images = []
 
     # 匹配所有链接格式 [文本](URL)
-    link_pattern = r'\[([^\]]*)\]\(([^)]+)\)'
-    matches = re.findall(link_pattern, evidence_content)
+    matches = _EVIDENCE_LINK_RE.findall(evidence_content)
 
     for text, url in matches:
         url = url.strip()
-        # 检查是否为图片链接
-        if url.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp')):
-            evidence_images.append(url)
-        else:
-            evidence_links.append(url)
+        # 检查是否为图片链接，忽略查询参数和锚点
+        ext = url.split('?', 1)[0].split('#', 1)[0].rpartition('.')[2].lower()
+        (evidence_images if ext in _IMG_EXTS else evidence_links).append(url)
 
     # 限制证据链接数量为3个
     evidence_links = evidence_links[:3]
@@ -112,42 +109,41 @@ def extract_evidence_links(evidence_content: str) -> Dict[str, List[str]]:
 
 def parse_company_row(row: List[str], last_city: str) -> Optional[Dict]:
     """解析单行公司数据"""
-    try:
-        if len(row) < 5:
-            logger.warning(f"行数据不完整，跳过: {row}")
-            return None
+    if len(row) < 5:
+        logger.warning(f"行数据不完整，跳过: {row}")
+        return None
 
-        # 跳过表头行
-        if row[0] == '所在城市' or row[1] == '公司名字':
-            return None
+    # 跳过表头行（parse_markdown_table 已过滤，此处仅作防御）
+    if row[0] == '所在城市' or row[1] == '公司名字':
+        return None
 
-        city = row[0] if row[0] else last_city
-        raw_company_text = row[1]
-        evidence_time = row[2]
-        work_schedule = row[3]
-        evidence_content = row[4] if len(row) > 4 else ""
+    city = row[0] if row[0] else last_city
+    raw_company_text = row[1]
+    evidence_time = row[2]
+    work_schedule = row[3]
+    evidence_content = row[4]
 
+    try:
         # 提取公司信息
         company_info = extract_company_info(raw_company_text)
 
         # 提取证据链接
         evidence_data = extract_evidence_links(evidence_content)
-
-        return {
-            "city": city,
-            "company_name": company_info["company_name"],
-            "company_url": company_info["company_url"],
-            "evidence_time": evidence_time,
-            "work_schedule": work_schedule,
-            "evidence_links": evidence_data["evidence_links"],
-            "evidence_images": evidence_data["evidence_images"],
-            "raw_company_text": raw_company_text
-        }
-
     except Exception as e:
         logger.error(f"解析行数据失败: {row}, 错误: {str(e)}")
         return None
 
+    return {
+        "city": city,
+        "company_name": company_info["company_name"],
+        "company_url": company_info["company_url"],
+        "evidence_time": evidence_time,
+        "work_schedule": work_schedule,
+        "evidence_links": evidence_data["evidence_links"],
+        "evidence_images": evidence_data["evidence_images"],
+        "raw_company_text": raw_company_text
+    }
+
 def parse_blacklist_file(file_path: str) -> List[Dict]:
     """解析黑名单文件"""
     logger.info(f"开始解析文件: {file_path}")
@@ -157,8 +153,7 @@ def parse_blacklist_file(file_path: str) -> List[Dict]:
         return []
 
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
+        content = Path(file_path).read_text(encoding='utf-8')
 
         # 提取表格部分
         table_content = extract_markdown_table(content)
@@ -177,7 +172,7 @@ def parse_blacklist_file(file_path: str) -> List[Dict]:
         # 解析每一行
         companies = []
         last_city = ""
-        error_count = 0
+        error_lines = []
 
         for i, row in enumerate(table_data):
             company = parse_company_row(row, last_city)
@@ -185,12 +180,14 @@ def parse_blacklist_file(file_path: str) -> List[Dict]:
                 companies.append(company)
                 last_city = company["city"]  # 更新上一个城市
             else:
-                error_count += 1
-                # 记录错误行
-                with open(PARSE_ERRORS_LOG, 'a', encoding='utf-8') as f:
-                    f.write(f"行 {i+1}: {row}\n")
+                # 记录错误行，循环结束后统一写入
+                error_lines.append(f"行 {i+1}: {row}\n")
+
+        if error_lines:
+            with open(PARSE_ERRORS_LOG, 'a', encoding='utf-8') as f:
+                f.writelines(error_lines)
 
-        logger.info(f"解析完成: 成功 {len(companies)} 条, 失败 {error_count} 条")
+        logger.info(f"解析完成: 成功 {len(companies)} 条, 失败 {len(error_lines)} 条")
         return companies
 
     except Exception as e:
@@ -204,7 +201,7 @@ def save_companies_json(companies: List[Dict], output_path: str):
         Path(output_path).parent.mkdir(parents=True, exist_ok=True)
 
         with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(companies, f, ensure_ascii=False, indent=2)
+            f.write(json.dumps(companies, ensure_ascii=False, indent=2))
 
         logger.info(f"数据已保存到: {output_path}")
         logger.info(f"总计 {len(companies)} 家公司")
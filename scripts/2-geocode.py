@@ -8,8 +8,13 @@
 
 import json
 import logging
+import itertools
+import threading
 import time
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from pathlib import Path
 from typing import List, Dict, Optional, Tuple
 import os
@@ -41,26 +46,99 @@ GEOCODE_ERRORS_LOG = "data/geocode_errors.log"
 GAODE_API_KEY = os.getenv('GAODE_API_KEY', '')
 GEOCODE_PROVIDER = os.getenv('GEOCODE_PROVIDER', 'gaode')
 GEOCODE_BATCH_SIZE = int(os.getenv('GEOCODE_BATCH_SIZE', '50'))
+# 并发请求数与每秒请求数上限（高德个人开发者地理编码QPS默认为3，小于等于0表示不限速）
+GEOCODE_CONCURRENCY = int(os.getenv('GEOCODE_CONCURRENCY', '8'))
+GEOCODE_QPS = float(os.getenv('GEOCODE_QPS', '3'))
+CACHE_EXPIRY_DAYS = int(os.getenv('CACHE_EXPIRY_DAYS', '90'))
 
 # 高德API配置
 GAODE_GEOCODE_URL = "https://restapi.amap.com/v3/geocode/geo"
 GAODE_BATCH_GEOCODE_URL = "https://restapi.amap.com/v3/geocode/geo"
+# 批量地理编码单次最多10个地址
+GAODE_BATCH_MAX = 10
+
+# 城市回退坐标在缓存文件中的键
+CITY_FALLBACK_CACHE_KEY = "__city_fallback__"
+
+class GeocodeRequestError(Exception):
+    """地理编码请求失败（网络错误或接口返回错误状态），区别于地址无匹配结果"""
+
+class RateLimiter:
+    """线程安全的令牌桶限流器，rate 小于等于0时不限速"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.capacity = max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """获取一个令牌，令牌不足时阻塞等待"""
+        if self.rate <= 0:
+            return
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
 
 class Geocoder:
     def __init__(self, api_key: str, cache_file: Optional[str] = None):
         self.api_key = api_key
         self.cache_file = cache_file
+        # 城市回退坐标缓存，由load_cache一并加载；值为None表示本次运行中该城市已查询失败
+        self.city_fallback_cache: Dict[str, Optional[Dict]] = {}
         self.cache = self.load_cache()
+        # 本次运行的时间戳及缓存有效期截止时间，构造时计算一次
+        run_time = datetime.now()
+        self._run_ts = run_time.isoformat()
+        self._run_epoch = run_time.timestamp()
+        self._cache_cutoff = self._run_epoch - CACHE_EXPIRY_DAYS * 86400
         self.error_count = 0
         self.success_count = 0
         self.cache_hit_count = 0
+        self._error_buffer: List[str] = []
+        self._lock = threading.Lock()
+        self._city_locks: Dict[str, threading.Lock] = {}
+        self.rate_limiter = RateLimiter(GEOCODE_QPS)
+
+        # 复用连接（HTTP keep-alive），避免每次请求重新握手；对限流和服务端错误自动重试
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=max(GEOCODE_CONCURRENCY, 16),
+            max_retries=Retry(total=3, backoff_factor=0.3,
+                              status_forcelist=[429, 500, 502, 503, 504])
+        )
+        self.session.mount('https://', adapter)
+
+    def load_cache(self) -> Dict[Tuple[str, str], Dict]:
+        """加载地理编码缓存
 
-    def load_cache(self) -> Dict[str, Dict]:
-        """加载地理编码缓存"""
+        磁盘上以 "城市@公司名" 为键，内存中转换为 (城市, 公司名) 元组键
+        """
         if self.cache_file and Path(self.cache_file).exists():
             try:
-                with open(self.cache_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                cache = {}
+                disk_cache = json.loads(Path(self.cache_file).read_bytes())
+                self.city_fallback_cache = disk_cache.pop(CITY_FALLBACK_CACHE_KEY, {})
+                for key, cached_data in disk_cache.items():
+                    # 兼容旧缓存：仅有ISO格式timestamp的条目补充epoch时间戳ts
+                    if 'ts' not in cached_data:
+                        try:
+                            cached_data['ts'] = datetime.fromisoformat(cached_data['timestamp']).timestamp()
+                        except (KeyError, TypeError, ValueError):
+                            cached_data['ts'] = 0
+                    city, _, company_name = key.partition('@')
+                    cache[(city, company_name)] = cached_data
+                return cache
             except Exception as e:
                 logger.warning(f"加载缓存失败: {str(e)}")
         return {}
@@ -70,134 +148,231 @@ class Geocoder:
         if self.cache_file:
             try:
                 Path(self.cache_file).parent.mkdir(parents=True, exist_ok=True)
+                disk_cache = {f"{city}@{company_name}": cached_data
+                              for (city, company_name), cached_data in self.cache.items()}
+                # 仅持久化成功的城市坐标，失败可能是临时网络问题，下次运行重试
+                disk_cache[CITY_FALLBACK_CACHE_KEY] = {
+                    city: cached_data for city, cached_data in self.city_fallback_cache.items()
+                    if cached_data is not None
+                }
                 with open(self.cache_file, 'w', encoding='utf-8') as f:
-                    json.dump(self.cache, f, ensure_ascii=False, indent=2)
+                    f.write(json.dumps(disk_cache, ensure_ascii=False, indent=2))
             except Exception as e:
                 logger.error(f"保存缓存失败: {str(e)}")
 
-    def get_cache_key(self, company_name: str, city: str) -> str:
-        """生成缓存键"""
-        return f"{city}@{company_name}"
+    def flush_errors(self):
+        """将缓冲的地理编码错误一次性写入日志"""
+        if not self._error_buffer:
+            return
+        try:
+            Path(GEOCODE_ERRORS_LOG).parent.mkdir(parents=True, exist_ok=True)
+            with open(GEOCODE_ERRORS_LOG, 'a', encoding='utf-8') as f:
+                f.writelines(self._error_buffer)
+            self._error_buffer.clear()
+        except Exception as e:
+            logger.error(f"写入错误日志失败: {str(e)}")
 
     def get_cached_coordinates(self, company_name: str, city: str) -> Optional[Dict]:
         """从缓存获取坐标"""
-        cache_key = self.get_cache_key(company_name, city)
-        cached_data = self.cache.get(cache_key)
+        cached_data = self.cache.get((city, company_name))
 
         if cached_data:
-            # 检查缓存有效期（90天）
-            timestamp = cached_data.get('timestamp', '')
-            if timestamp:
-                try:
-                    cache_date = datetime.fromisoformat(timestamp)
-                    days_diff = (datetime.now() - cache_date).days
-                    if days_diff <= 90:
-                        self.cache_hit_count += 1
-                        return cached_data
-                    else:
-                        logger.info(f"缓存过期: {cache_key}")
-                except:
-                    pass
+            # 检查缓存有效期（默认90天）
+            if cached_data.get('ts', 0) >= self._cache_cutoff:
+                with self._lock:
+                    self.cache_hit_count += 1
+                return cached_data
+            logger.info(f"缓存过期: {city}@{company_name}")
 
         return None
 
     def cache_coordinates(self, company_name: str, city: str, coordinates: List[float],
                          source: str = "exact"):
         """缓存坐标信息"""
-        cache_key = self.get_cache_key(company_name, city)
-        self.cache[cache_key] = {
+        self.cache[(city, company_name)] = {
             "coords": coordinates,
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": self._run_ts,
+            "ts": self._run_epoch,
             "source": source
         }
 
-    def geocode_address(self, address: str) -> Optional[Tuple[List[float], str]]:
-        """使用高德API进行地理编码"""
+    def _request_geocode(self, url: str, params: Dict) -> Dict:
+        """发送地理编码请求，网络错误或接口返回错误状态时抛出 GeocodeRequestError"""
         if not self.api_key:
-            logger.error("缺少高德API密钥")
-            return None
+            raise GeocodeRequestError("缺少高德API密钥")
+
+        self.rate_limiter.acquire()
+
+        try:
+            response = self.session.get(url, params=params, timeout=10)
+            response.raise_for_status()
+            data = response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            raise GeocodeRequestError(f"API请求失败: {str(e)}") from e
 
-        params = {
+        if data.get('status') != '1':
+            raise GeocodeRequestError(f"API返回错误: {data.get('info', '')}")
+        return data
+
+    def geocode_address(self, address: str) -> Optional[Tuple[List[float], str]]:
+        """使用高德API进行地理编码，无匹配结果时返回None，请求失败时抛出 GeocodeRequestError"""
+        data = self._request_geocode(GAODE_GEOCODE_URL, {
             'key': self.api_key,
             'address': address,
             'output': 'json'
-        }
+        })
 
-        try:
-            response = requests.get(GAODE_GEOCODE_URL, params=params, timeout=10)
-            response.raise_for_status()
+        if data.get('geocodes'):
+            coordinates = parse_location(data['geocodes'][0].get('location'))
+            if coordinates:
+                return coordinates, "exact"
 
-            data = response.json()
-            if data.get('status') == '1' and data.get('geocodes'):
-                location = data['geocodes'][0].get('location', '')
-                if location:
-                    # 高德返回的是GCJ-02坐标系，需要转换为WGS84
-                    lng, lat = map(float, location.split(','))
-                    # 简化的坐标转换（实际项目中可能需要更精确的转换）
-                    wgs_lng, wgs_lat = gcj02_to_wgs84(lng, lat)
-                    return [wgs_lng, wgs_lat], "exact"
-
-            logger.warning(f"地理编码失败: {address}")
-            return None
+        logger.warning(f"地理编码无匹配结果: {address}")
+        return None
 
-        except requests.exceptions.RequestException as e:
-            logger.error(f"API请求失败: {str(e)}")
-            return None
-        except Exception as e:
-            logger.error(f"地理编码异常: {str(e)}")
-            return None
+    def geocode_addresses_batch(self, addresses: List[str]) -> List[Optional[Tuple[List[float], str]]]:
+        """使用高德批量API进行地理编码，按输入顺序返回结果（最多10个地址）
 
-    def geocode_company(self, company_name: str, city: str) -> Optional[Dict]:
-        """对公司进行地理编码"""
-        # 首先检查缓存
+        无匹配结果的地址对应None，请求失败时抛出 GeocodeRequestError
+        """
+        data = self._request_geocode(GAODE_BATCH_GEOCODE_URL, {
+            'key': self.api_key,
+            'address': '|'.join(address.replace('|', ' ') for address in addresses),
+            'batch': 'true',
+            'output': 'json'
+        })
+
+        geocodes = data.get('geocodes') or []
+        if len(geocodes) != len(addresses):
+            # 结果无法与输入一一对应时逐个重试
+            logger.warning(f"批量地理编码结果数量不匹配: {len(geocodes)}/{len(addresses)}")
+            return [self.geocode_address(address) for address in addresses]
+
+        results = []
+        for address, geocode in zip(addresses, geocodes):
+            coordinates = parse_location(geocode.get('location'))
+            if coordinates:
+                results.append((coordinates, "exact"))
+            else:
+                logger.warning(f"地理编码无匹配结果: {address}")
+                results.append(None)
+        return results
+
+    def get_cached_result(self, company_name: str, city: str) -> Optional[Dict]:
+        """从缓存获取地理编码结果（不逐条输出日志，由main汇总）"""
         cached = self.get_cached_coordinates(company_name, city)
         if cached:
-            logger.info(f"缓存命中: {company_name} - {city}")
             return {
                 "coordinates": cached["coords"],
                 "geocode_source": "cache",
                 "geocode_timestamp": cached["timestamp"]
             }
+        return None
 
-        # 尝试精确模式：城市 + 公司名
-        exact_address = f"{city}{company_name}"
-        result = self.geocode_address(exact_address)
+    def geocode_companies_batch(self, companies: List[Dict]) -> List[Dict]:
+        """批量地理编码一组未缓存的公司
 
-        if result:
-            coordinates, source = result
-            self.cache_coordinates(company_name, city, coordinates, source)
-            self.success_count += 1
-            return {
-                "coordinates": coordinates,
-                "geocode_source": source,
-                "geocode_timestamp": datetime.now().isoformat()
-            }
+        无匹配结果的公司回退到城市模式；请求失败时整组标记为失败且不写缓存，下次运行重试
+        """
+        addresses = [f"{company['city']}{company['company_name']}" for company in companies]
+        try:
+            results = self.geocode_addresses_batch(addresses)
+        except GeocodeRequestError as e:
+            logger.error(str(e))
+            return [self.mark_failed(company['company_name'], company['city']) for company in companies]
+
+        geo_results = []
+        for company, result in zip(companies, results):
+            company_name, city = company['company_name'], company['city']
+            if result:
+                coordinates, source = result
+                self.cache_coordinates(company_name, city, coordinates, source)
+                with self._lock:
+                    self.success_count += 1
+                geo_results.append({
+                    "coordinates": coordinates,
+                    "geocode_source": source,
+                    "geocode_timestamp": self._run_ts
+                })
+            else:
+                geo_results.append(self.geocode_city_fallback(company_name, city))
+        return geo_results
+
+    def geocode_city(self, city: str) -> Optional[List[float]]:
+        """获取城市坐标，同一城市只请求一次API
+
+        城市无匹配结果时返回None，请求失败时抛出 GeocodeRequestError 且不记录到缓存
+        """
+        with self._lock:
+            city_lock = self._city_locks.setdefault(city, threading.Lock())
+
+        with city_lock:
+            if city in self.city_fallback_cache:
+                cached_data = self.city_fallback_cache[city]
+                if cached_data is None:
+                    return None
+                if cached_data.get('ts', 0) >= self._cache_cutoff:
+                    return cached_data['coords']
+
+            logger.info(f"尝试城市回退模式: {city}")
+            city_result = self.geocode_address(city)
+            if city_result:
+                coordinates, _ = city_result
+                self.city_fallback_cache[city] = {
+                    "coords": coordinates,
+                    "timestamp": self._run_ts,
+                    "ts": self._run_epoch
+                }
+                return coordinates
+
+            self.city_fallback_cache[city] = None
+            return None
 
-        # 回退模式：仅城市
-        logger.info(f"尝试城市回退模式: {city}")
-        city_result = self.geocode_address(city)
+    def geocode_city_fallback(self, company_name: str, city: str) -> Dict:
+        """回退模式：仅使用城市进行地理编码"""
+        try:
+            coordinates = self.geocode_city(city)
+        except GeocodeRequestError as e:
+            logger.error(str(e))
+            return self.mark_failed(company_name, city)
 
-        if city_result:
-            coordinates, source = city_result
+        if coordinates:
             self.cache_coordinates(company_name, city, coordinates, "city_fallback")
-            self.success_count += 1
+            with self._lock:
+                self.success_count += 1
             return {
                 "coordinates": coordinates,
                 "geocode_source": "city_fallback",
-                "geocode_timestamp": datetime.now().isoformat()
+                "geocode_timestamp": self._run_ts
             }
 
-        # 地理编码失败
-        self.error_count += 1
-        with open(GEOCODE_ERRORS_LOG, 'a', encoding='utf-8') as f:
-            f.write(f"{datetime.now().isoformat()} - {company_name} - {city}\n")
+        return self.mark_failed(company_name, city)
+
+    def mark_failed(self, company_name: str, city: str) -> Dict:
+        """记录地理编码失败，失败结果不写入缓存"""
+        with self._lock:
+            self.error_count += 1
+            self._error_buffer.append(f"{self._run_ts} - {company_name} - {city}\n")
 
         return {
             "coordinates": None,
             "geocode_source": "failed",
-            "geocode_timestamp": datetime.now().isoformat()
+            "geocode_timestamp": self._run_ts
         }
 
+def parse_location(location) -> Optional[List[float]]:
+    """解析高德返回的"经度,纬度"字符串，未匹配时高德可能返回空字符串或空数组"""
+    if not location or not isinstance(location, str):
+        return None
+    try:
+        # 高德返回的是GCJ-02坐标系，需要转换为WGS84
+        lng, lat = map(float, location.split(','))
+    except ValueError:
+        return None
+    # 简化的坐标转换（实际项目中可能需要更精确的转换）
+    wgs_lng, wgs_lat = gcj02_to_wgs84(lng, lat)
+    return [wgs_lng, wgs_lat]
+
 def gcj02_to_wgs84(lng: float, lat: float) -> Tuple[float, float]:
     """
     简化的GCJ-02到WGS84坐标转换
@@ -209,8 +384,7 @@ def gcj02_to_wgs84(lng: float, lat: float) -> Tuple[float, float]:
 def load_companies(file_path: str) -> List[Dict]:
     """加载公司数据"""
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        return json.loads(Path(file_path).read_bytes())
     except Exception as e:
         logger.error(f"加载公司数据失败: {str(e)}")
         return []
@@ -220,7 +394,7 @@ def save_companies_with_coords(companies: List[Dict], output_path: str):
     try:
         Path(output_path).parent.mkdir(parents=True, exist_ok=True)
         with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(companies, f, ensure_ascii=False, indent=2)
+            f.write(json.dumps(companies, ensure_ascii=False, indent=2))
         logger.info(f"数据已保存到: {output_path}")
     except Exception as e:
         logger.error(f"保存数据失败: {str(e)}")
@@ -249,32 +423,43 @@ def main():
     # 创建地理编码器
     geocoder = Geocoder(GAODE_API_KEY, GEOCACHE_FILE)
 
-    # 批量地理编码
-    companies_with_coords = []
+    # 先批量查缓存，仅未命中的公司进入API请求
+    geo_results: List[Optional[Dict]] = [None] * len(companies)
+    pending = []
     for i, company in enumerate(companies):
-        logger.info(f"处理 {i+1}/{len(companies)}: {company['company_name']}")
-
-        # 地理编码
-        geo_result = geocoder.geocode_company(
-            company['company_name'],
-            company['city']
+        geo_results[i] = geocoder.get_cached_result(company['company_name'], company['city'])
+        if geo_results[i] is None:
+            pending.append(i)
+    logger.info(f"缓存命中 {len(companies) - len(pending)} 家，待请求API {len(pending)} 家")
+
+    # 每10个地址一组调用批量API并发执行，请求速率由geocoder内部的令牌桶控制
+    processed = 0
+    with ThreadPoolExecutor(max_workers=GEOCODE_CONCURRENCY) as executor:
+        batches = list(itertools.batched(pending, GAODE_BATCH_MAX))
+        batch_results = executor.map(
+            lambda batch: geocoder.geocode_companies_batch([companies[i] for i in batch]),
+            batches
         )
 
-        # 合并结果
+        for batch, results in zip(batches, batch_results):
+            for i, geo_result in zip(batch, results):
+                geo_results[i] = geo_result
+
+            processed += len(batch)
+            if processed // GEOCODE_BATCH_SIZE != (processed - len(batch)) // GEOCODE_BATCH_SIZE:
+                logger.info(f"已请求 {processed}/{len(pending)} 家公司")
+
+    # 合并结果
+    companies_with_coords = []
+    for company, geo_result in zip(companies, geo_results):
         company_with_coords = company.copy()
         if geo_result:
             company_with_coords.update(geo_result)
         companies_with_coords.append(company_with_coords)
 
-        # 批量处理间隔
-        if (i + 1) % GEOCODE_BATCH_SIZE == 0:
-            logger.info(f"已处理 {i + 1} 家公司，暂停2秒...")
-            time.sleep(2)
-        
-        time.sleep(0.5)
-
-    # 保存缓存
+    # 保存缓存和错误日志
     geocoder.save_cache()
+    geocoder.flush_errors()
 
     # 保存结果
     save_companies_with_coords(companies_with_coords, OUTPUT_FILE)
@@ -6,12 +6,19 @@
 输出：public/companies.geojson
 """
 
+import argparse
 import json
 import logging
+from collections import Counter
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Optional
 from datetime import datetime
 
+try:
+    import orjson
+except ImportError:  # orjson 为可选依赖，缺失时回退到标准库 json
+    orjson = None
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -23,6 +30,9 @@ logger = logging.getLogger(__name__)
 INPUT_FILE = "data/companies-with-coords.json"
 OUTPUT_FILE = "public/companies.geojson"
 
+# 数据更新日期，每次运行计算一次
+UPDATE_DATE = datetime.now().strftime('%Y-%m-%d')
+
 # 配色方案 - 根据制度类型
 COLOR_SCHEME = {
     '996': '#ff5252',      # 红色
@@ -39,37 +49,45 @@ def get_work_schedule_color(work_schedule: str) -> str:
     if not work_schedule:
         return COLOR_SCHEME['default']
 
-    work_schedule_lower = work_schedule.lower()
-
-    # 检查是否包含特定关键词
-    if '996' in work_schedule_lower or '997' in work_schedule_lower or '007' in work_schedule_lower:
+    # 关键词均为数字或中文，无需转换大小写；按 996/997/007 > 大小周 > 995/10106 的优先级检查
+    if '996' in work_schedule or '997' in work_schedule or '007' in work_schedule:
         return COLOR_SCHEME['996']
     elif '大小周' in work_schedule:
         return COLOR_SCHEME['大小周']
-    elif '995' in work_schedule_lower or '10106' in work_schedule_lower:
+    elif '995' in work_schedule or '10106' in work_schedule:
         return COLOR_SCHEME['995']
     else:
         return COLOR_SCHEME['default']
 
-def create_geojson_feature(company: Dict) -> Dict:
-    """创建GeoJSON Feature对象"""
+def create_geojson_feature(company: Dict, string_cache: Optional[Dict[str, str]] = None) -> Dict:
+    """创建GeoJSON Feature对象
+
+    string_cache 用于在多个Feature之间复用城市、制度等重复字符串
+    """
     # 获取坐标
     coordinates = company.get('coordinates')
     if not coordinates or len(coordinates) != 2:
+        logger.warning(f"跳过无有效坐标的公司: {company.get('company_name', 'Unknown')}")
         return None
 
+    city = company.get('city', '')
+    schedule = company.get('work_schedule', '')
+    if string_cache is not None:
+        city = string_cache.setdefault(city, city)
+        schedule = string_cache.setdefault(schedule, schedule)
+
     # 获取颜色
-    color = get_work_schedule_color(company.get('work_schedule', ''))
+    color = get_work_schedule_color(schedule)
 
     # 构建properties
     properties = {
-        "city": company.get('city', ''),
+        "city": city,
         "name": company.get('company_name', ''),
         "url": company.get('company_url', ''),
-        "schedule": company.get('work_schedule', ''),
+        "schedule": schedule,
         "evidence": company.get('evidence_links', [])[:3],  # 限制为3个证据
         "color": color,
-        "update_date": datetime.now().strftime('%Y-%m-%d')
+        "update_date": UPDATE_DATE
     }
 
     # 创建Feature对象
@@ -87,24 +105,23 @@ def create_geojson_feature(company: Dict) -> Dict:
 def load_companies_with_coords(file_path: str) -> List[Dict]:
     """加载带坐标的公司数据"""
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        data = Path(file_path).read_bytes()
+        if orjson is not None:
+            return orjson.loads(data)
+        return json.loads(data)
     except Exception as e:
         logger.error(f"加载公司数据失败: {str(e)}")
         return []
 
 def create_geojson_collection(companies: List[Dict]) -> Dict:
     """创建GeoJSON FeatureCollection"""
-    features = []
-    skipped_count = 0
-
-    for company in companies:
-        feature = create_geojson_feature(company)
-        if feature:
-            features.append(feature)
-        else:
-            skipped_count += 1
-            logger.warning(f"跳过无有效坐标的公司: {company.get('company_name', 'Unknown')}")
+    # 城市和制度描述在公司之间大量重复，共享同一字符串对象以减少内存占用
+    string_cache: Dict[str, str] = {}
+    features = [
+        feature for feature in (create_geojson_feature(company, string_cache) for company in companies)
+        if feature is not None
+    ]
+    skipped_count = len(companies) - len(features)
 
     logger.info(f"GeoJSON转换: 成功 {len(features)} 个, 跳过 {skipped_count} 个")
 
@@ -137,37 +154,23 @@ def validate_geojson(geojson_data: Dict) -> bool:
             logger.error("features不能为空")
             return False
 
-        # 验证每个feature
-        for i, feature in enumerate(features):
-            if feature.get("type") != "Feature":
-                logger.error(f"Feature {i} 类型错误")
-                return False
-
-            if "geometry" not in feature:
-                logger.error(f"Feature {i} 缺少geometry")
-                return False
-
-            geometry = feature["geometry"]
-            if geometry.get("type") != "Point":
-                logger.error(f"Feature {i} geometry类型错误")
-                return False
-
-            if "coordinates" not in geometry:
-                logger.error(f"Feature {i} 缺少coordinates")
-                return False
-
-            coordinates = geometry["coordinates"]
-            if not isinstance(coordinates, list) or len(coordinates) != 2:
-                logger.error(f"Feature {i} coordinates格式错误")
-                return False
-
-            if not all(isinstance(coord, (int, float)) for coord in coordinates):
-                logger.error(f"Feature {i} coordinates必须是数字")
-                return False
-
-            if "properties" not in feature:
-                logger.error(f"Feature {i} 缺少properties")
-                return False
+        # 验证每个feature：直接按键取值，缺失字段或类型不符时由异常处理
+        i = 0
+        try:
+            for i, feature in enumerate(features):
+                geometry = feature["geometry"]
+                coordinates = geometry["coordinates"]
+                if not (feature["type"] == "Feature"
+                        and geometry["type"] == "Point"
+                        and "properties" in feature
+                        and isinstance(coordinates, list) and len(coordinates) == 2
+                        and isinstance(coordinates[0], (int, float))
+                        and isinstance(coordinates[1], (int, float))):
+                    logger.error(f"Feature {i} 格式错误")
+                    return False
+        except (KeyError, TypeError):
+            logger.error(f"Feature {i} 缺少必要字段")
+            return False
 
         logger.info("GeoJSON格式验证通过")
         return True
@@ -176,14 +179,29 @@ def validate_geojson(geojson_data: Dict) -> bool:
         logger.error(f"GeoJSON验证失败: {str(e)}")
         return False
 
-def save_geojson(geojson_data: Dict, output_path: str):
-    """保存GeoJSON文件"""
+def save_geojson(geojson_data: Dict, output_path: str, ndjson: bool = False):
+    """保存GeoJSON文件
+
+    ndjson 为真时不缩进，每行写入一个Feature，结果仍是合法的FeatureCollection
+    """
     try:
         # 确保输出目录存在
         Path(output_path).parent.mkdir(parents=True, exist_ok=True)
 
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(geojson_data, f, ensure_ascii=False, indent=2)
+        if ndjson:
+            with open(output_path, 'w', encoding='utf-8') as f:
+                f.write('{"type":"FeatureCollection","features":[\n')
+                for i, feature in enumerate(geojson_data["features"]):
+                    if i:
+                        f.write(',\n')
+                    f.write(json.dumps(feature, ensure_ascii=False, separators=(',', ':')))
+                f.write('\n]}\n')
+        elif orjson is not None:
+            with open(output_path, 'wb') as f:
+                f.write(orjson.dumps(geojson_data, option=orjson.OPT_INDENT_2))
+        else:
+            with open(output_path, 'w', encoding='utf-8') as f:
+                f.write(json.dumps(geojson_data, ensure_ascii=False, indent=2))
 
         logger.info(f"GeoJSON文件已保存: {output_path}")
 
@@ -202,21 +220,15 @@ def generate_statistics(companies: List[Dict], features: List[Dict]):
     logger.info(f"  输出特征数: {len(features)}")
 
     # 按城市统计
-    city_stats = {}
-    for feature in features:
-        city = feature["properties"]["city"]
-        city_stats[city] = city_stats.get(city, 0) + 1
+    city_stats = Counter(feature["properties"]["city"] for feature in features)
 
     logger.info(f"  涉及城市: {len(city_stats)} 个")
     if city_stats:
-        top_cities = sorted(city_stats.items(), key=lambda x: x[1], reverse=True)[:5]
+        top_cities = city_stats.most_common(5)
         logger.info(f"  前5城市: {top_cities}")
 
     # 按制度类型统计
-    schedule_stats = {}
-    for feature in features:
-        schedule = feature["properties"]["schedule"]
-        schedule_stats[schedule] = schedule_stats.get(schedule, 0) + 1
+    schedule_stats = Counter(feature["properties"]["schedule"] for feature in features)
 
     logger.info(f"  制度类型: {len(schedule_stats)} 种")
     if schedule_stats:
@@ -225,6 +237,11 @@ def generate_statistics(companies: List[Dict], features: List[Dict]):
 
 def main():
     """主函数"""
+    parser = argparse.ArgumentParser(description="将带坐标的公司数据转换为GeoJSON格式")
+    parser.add_argument('--ndjson', action='store_true',
+                        help="不缩进输出，每行一个Feature（适用于数据量较大时）")
+    args = parser.parse_args()
+
     logger.info("开始执行GeoJSON生成脚本")
 
     # 加载公司数据
@@ -244,7 +261,7 @@ def main():
         return 1
 
     # 保存GeoJSON文件
-    save_geojson(geojson_collection, OUTPUT_FILE)
+    save_geojson(geojson_collection, OUTPUT_FILE, ndjson=args.ndjson)
 
     # 生成统计信息
     generate_statistics(companies, geojson_collection["features"])